@@ -1,14 +1,32 @@
+import asyncio
+import functools
+import math
+import os
+import threading
+
 from fastapi import FastAPI, Query
+from fastapi.responses import ORJSONResponse
 import rasterio
 import numpy as np
 from pyproj import Transformer
-from math import cos, sin, radians
+from rasterio.windows import Window
 
 # ============================================================
 # CONFIG
 # ============================================================
 
-NLCD_PATH = r"C:\wind_exposure_local\nlcd\nlcd_2021_conus.tif"
+# Point at a Cloud-Optimized GeoTIFF; for a remote COG use
+# /vsicurl/https://... so GDAL range-reads single blocks (see README)
+NLCD_PATH = os.environ.get(
+    "NLCD_PATH", r"C:\wind_exposure_local\nlcd\nlcd_2021_conus.tif"
+)
+
+# GDAL tuning for remote COG access: skip directory listings, restrict
+# probing to .tif, and merge adjacent HTTP range requests
+os.environ.setdefault("GDAL_DISABLE_READDIR_ON_OPEN", "EMPTY_DIR")
+os.environ.setdefault("CPL_VSIL_CURL_ALLOWED_EXTENSIONS", ".tif")
+os.environ.setdefault("GDAL_HTTP_MERGE_CONSECUTIVE_RANGES", "YES")
+os.environ.setdefault("VSI_CACHE", "TRUE")
 
 # ASCE directional sectors (±45°)
 DIRECTIONS = [
@@ -25,6 +43,13 @@ DIRECTIONS = [
 FETCH_DISTANCE_M = 800      # conservative ASCE fetch
 SAMPLE_STEP_M = 30          # NLCD resolution
 
+# sample geometry never changes between requests, so build it once
+_DISTANCES_M = np.arange(0, FETCH_DISTANCE_M, SAMPLE_STEP_M, dtype=np.float64)
+_SECTOR_ANGLES = tuple(
+    np.arange(start_deg, end_deg, 5, dtype=np.float64)
+    for _, start_deg, end_deg in DIRECTIONS
+)
+
 # ============================================================
 # NLCD → ASCE EXPOSURE MAP
 # ============================================================
@@ -49,75 +74,296 @@ NLCD_TO_EXPOSURE = {
     82: "C",
 }
 
+# vectorized counterpart of NLCD_TO_EXPOSURE: NLCD codes are uint8, so a
+# flat 256-entry table maps a whole sample array in one gather
+_EXPOSURE_CLASSES = ("B", "C", "D")
+_EXPOSURE_LUT = np.full(256, _EXPOSURE_CLASSES.index("C"), dtype=np.uint8)
+for _code, _exp in NLCD_TO_EXPOSURE.items():
+    _EXPOSURE_LUT[_code] = _EXPOSURE_CLASSES.index(_exp)
+
 # ============================================================
 # APP
 # ============================================================
 
 app = FastAPI(
     title="Local ASCE 7 Wind Exposure Tool",
-    version="1.0"
+    version="1.0",
+    default_response_class=ORJSONResponse
 )
 
+# Shared across requests: reopening the GeoTIFF (and rebuilding the pyproj
+# pipeline) per request costs hundreds of ms, so both are process-lifetime
+# singletons — lazy, so importing the module never touches the raster.
+@functools.lru_cache(maxsize=1)
+def _dataset():
+    return rasterio.open(NLCD_PATH)
+
+@functools.lru_cache(maxsize=1)
+def _transformer():
+    return Transformer.from_crs("EPSG:4326", _dataset().crs, always_xy=True)
+
+@app.on_event("startup")
+def _open_nlcd():
+    # warm the singletons so the first request doesn't pay the open cost
+    _transformer()
+    _region()
+
+@app.on_event("shutdown")
+def _close_nlcd():
+    _dataset().close()
+    _dataset.cache_clear()
+    _transformer.cache_clear()
+    _load_block.cache_clear()
+    _grid_params.cache_clear()
+    _use_albers.cache_clear()
+    _region.cache_clear()
+    _compute_sectors.cache_clear()
+
 # ============================================================
 # HELPERS
 # ============================================================
 
-def sample_nlcd(lat, lon, src, transformer):
-    x, y = transformer.transform(lon, lat)
-    row, col = src.index(x, y)
-    return int(src.read(1)[row, col])
+# rasterio dataset handles are not thread-safe; serialize reads
+_READ_LOCK = threading.Lock()
+
+def _snap(value):
+    # ~11 m grid; NLCD is 30 m, so coordinates this close hit the same pixels
+    return round(value, 4)
+
+def _pack_classes(classes):
+    # exposure classes packed 2 bits/pixel, 4 pixels/byte
+    classes = classes.ravel()
+    if classes.size % 4:
+        classes = np.pad(classes, (0, 4 - classes.size % 4))
+    quads = classes.reshape(-1, 4).astype(np.uint8)
+    return quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)
+
+def _unpack_at(packed, flat_idx):
+    # 2-bit class at the given flat pixel indexes
+    return (packed[flat_idx >> 2] >> ((flat_idx & 3) * 2)) & 3
+
+@functools.lru_cache(maxsize=1024)
+def _load_block(block_row, block_col):
+    # one cached block covers ~7.6 km of 30 m pixels, so successive
+    # requests near the same site never touch the dataset again; the
+    # majority vote only needs the exposure class, so blocks are stored
+    # pre-mapped and packed 2 bits/pixel — 4x less resident cache
+    src = _dataset()
+    bh, bw = src.block_shapes[0]
+    win = Window(block_col * bw, block_row * bh, bw, bh)
+    with _READ_LOCK:
+        block = src.read(1, window=win, boundless=True, fill_value=0)
+    return _pack_classes(_EXPOSURE_LUT[block])
+
+@functools.lru_cache(maxsize=1)
+def _grid_params():
+    # NLCD is north-up, so the inverse affine collapses to four scalars
+    t = _dataset().transform
+    return t.c, t.f, t.a, t.e
+
+def _sample_points(xs, ys):
+    """Exposure class (0/1/2 = B/C/D) at each projected coord."""
+    src = _dataset()
+    x_off, y_off, x_res, y_res = _grid_params()
+    cols = np.floor((xs - x_off) / x_res).astype(np.int64)
+    rows = np.floor((ys - y_off) / y_res).astype(np.int64)
+
+    # out-of-bounds points default to C, like unknown NLCD codes
+    out = np.full(rows.shape, _EXPOSURE_CLASSES.index("C"), dtype=np.uint8)
+    valid = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+
+    # sites inside the preloaded region resolve from RAM without GDAL
+    region = _region()
+    if region is not None:
+        packed, r_off, c_off, rh, rw = region
+        in_region = (
+            valid & (rows >= r_off) & (rows < r_off + rh)
+            & (cols >= c_off) & (cols < c_off + rw)
+        )
+        flat = (rows[in_region] - r_off) * rw + (cols[in_region] - c_off)
+        out[in_region] = _unpack_at(packed, flat)
+        valid &= ~in_region
+
+    bh, bw = src.block_shapes[0]
+    brs = rows // bh
+    bcs = cols // bw
+    for br, bc in {(int(r), int(c)) for r, c in zip(brs[valid], bcs[valid])}:
+        mask = valid & (brs == br) & (bcs == bc)
+        packed = _load_block(br, bc)
+        flat = (rows[mask] - br * bh) * bw + (cols[mask] - bc * bw)
+        out[mask] = _unpack_at(packed, flat)
+    return out
+
+# flat offsets of each sector's samples within the combined point array,
+# and the sector id of every sample for the fused classification pass
+_SECTOR_BOUNDS = np.concatenate(
+    ([0], np.cumsum([a.size * _DISTANCES_M.size for a in _SECTOR_ANGLES]))
+)
+_N_SECTORS = len(DIRECTIONS)
+_SECTOR_IDS = np.repeat(np.arange(_N_SECTORS), np.diff(_SECTOR_BOUNDS))
+
+def _build_offsets():
+    # static fetch offsets in meters for every sector, concatenated in
+    # sector order (cos -> east, sin -> north, matching the angle grid)
+    xs, ys = [], []
+    for angles in _SECTOR_ANGLES:
+        rad = np.radians(angles)
+        xs.append((np.cos(rad)[:, None] * _DISTANCES_M).ravel())
+        ys.append((np.sin(rad)[:, None] * _DISTANCES_M).ravel())
+    return np.concatenate(xs), np.concatenate(ys)
+
+_OFFSETS_X_M, _OFFSETS_Y_M = _build_offsets()
+
+# Closed-form EPSG:5070 forward projection (Snyder ellipsoidal Albers on
+# GRS80: lat_0=23, lat_1=29.5, lat_2=45.5, lon_0=-96). NLCD ships in this
+# CRS, so the origin can be projected without going through PROJ at all;
+# agrees with pyproj to sub-millimeter across CONUS.
+_ALB_A = 6378137.0
+_ALB_F = 1 / 298.257222101
+_ALB_E2 = _ALB_F * (2 - _ALB_F)
+_ALB_E = math.sqrt(_ALB_E2)
 
-def direction_vector(angle_deg):
-    return cos(radians(angle_deg)), sin(radians(angle_deg))
+def _alb_q(phi):
+    s = math.sin(phi)
+    return (1 - _ALB_E2) * (
+        s / (1 - _ALB_E2 * s * s)
+        - math.log((1 - _ALB_E * s) / (1 + _ALB_E * s)) / (2 * _ALB_E)
+    )
+
+def _alb_m(phi):
+    s = math.sin(phi)
+    return math.cos(phi) / math.sqrt(1 - _ALB_E2 * s * s)
+
+_ALB_LON0 = math.radians(-96.0)
+_ALB_N = (_alb_m(math.radians(29.5)) ** 2 - _alb_m(math.radians(45.5)) ** 2) / (
+    _alb_q(math.radians(45.5)) - _alb_q(math.radians(29.5))
+)
+_ALB_C = _alb_m(math.radians(29.5)) ** 2 + _ALB_N * _alb_q(math.radians(29.5))
+_ALB_RHO0 = _ALB_A * math.sqrt(_ALB_C - _ALB_N * _alb_q(math.radians(23.0))) / _ALB_N
+
+def _albers_forward(lat, lon):
+    """EPSG:4326 -> EPSG:5070 for a single point, without pyproj."""
+    rho = _ALB_A * math.sqrt(_ALB_C - _ALB_N * _alb_q(math.radians(lat))) / _ALB_N
+    theta = _ALB_N * (math.radians(lon) - _ALB_LON0)
+    return rho * math.sin(theta), _ALB_RHO0 - rho * math.cos(theta)
+
+@functools.lru_cache(maxsize=1)
+def _use_albers():
+    # only trust the closed form when the dataset really is EPSG:5070
+    return _dataset().crs.to_epsg() == 5070
+
+def _request_points(lat, lon):
+    """Projected coords of every sample point for all sectors, concatenated."""
+    # the NLCD CRS (CONUS Albers) is in meters, so project the origin once
+    # and do the upwind walk directly in projected coordinates — no
+    # flat-earth degree approximation and no per-point transform
+    if _use_albers():
+        x0, y0 = _albers_forward(lat, lon)
+    else:
+        x0, y0 = _transformer().transform(lon, lat)
+    return x0 + _OFFSETS_X_M, y0 + _OFFSETS_Y_M
+
+@functools.lru_cache(maxsize=1)
+def _region():
+    """Optional RAM-resident subregion for bounded deployments.
+
+    NLCD_REGION_BBOX="min_lon,min_lat,max_lon,max_lat" preloads that area
+    (padded by the fetch distance) as packed classes at startup, so sites
+    inside it never touch GDAL on the hot path.
+    """
+    bbox = os.environ.get("NLCD_REGION_BBOX")
+    if not bbox:
+        return None
+    min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+
+    src = _dataset()
+    corners = [
+        _albers_forward(lat, lon) if _use_albers()
+        else _transformer().transform(lon, lat)
+        for lat in (min_lat, max_lat) for lon in (min_lon, max_lon)
+    ]
+    xs = [c[0] for c in corners]
+    ys = [c[1] for c in corners]
+
+    x_off, y_off, x_res, y_res = _grid_params()
+    pad = FETCH_DISTANCE_M
+    col_min = max(int((min(xs) - pad - x_off) / x_res), 0)
+    col_max = min(int((max(xs) + pad - x_off) / x_res) + 1, src.width)
+    row_min = max(int((max(ys) + pad - y_off) / y_res), 0)   # y_res < 0
+    row_max = min(int((min(ys) - pad - y_off) / y_res) + 1, src.height)
+    if row_min >= row_max or col_min >= col_max:
+        return None
+
+    win = Window(col_min, row_min, col_max - col_min, row_max - row_min)
+    with _READ_LOCK:
+        block = src.read(1, window=win)
+    packed = _pack_classes(_EXPOSURE_LUT[block])
+    return packed, row_min, col_min, row_max - row_min, col_max - col_min
+
+def _classify_sectors(classes):
+    """Majority-rule exposure per sector, one C-level pass over all samples."""
+    counts = np.bincount(
+        _SECTOR_IDS * 3 + classes, minlength=_N_SECTORS * 3
+    ).reshape(_N_SECTORS, 3)
+    return [_EXPOSURE_CLASSES[i] for i in counts.argmax(axis=1)]
+
+@functools.lru_cache(maxsize=10000)
+def _compute_sectors(lat, lon):
+    """Full numeric pipeline for one site; runs in a worker thread.
+
+    rasterio releases the GIL during block reads, so concurrent requests
+    genuinely overlap their I/O without blocking the event loop. NLCD is
+    static and the inputs are pre-snapped, so results are cached whole:
+    a repeat query never touches the raster. Returns an immutable tuple
+    so cached entries can't be mutated by handlers.
+    """
+    xs, ys = _request_points(lat, lon)
+    return tuple(_classify_sectors(_sample_points(xs, ys)))
+
+# concurrent duplicate queries share one computation (singleflight):
+# the first caller does the work, the rest await its future
+_INFLIGHT = {}
+
+async def _sector_exposures(lat, lon):
+    key = (lat, lon)
+    fut = _INFLIGHT.get(key)
+    if fut is not None:
+        return await fut
+
+    fut = asyncio.get_running_loop().create_future()
+    _INFLIGHT[key] = fut
+    try:
+        finals = await asyncio.to_thread(_compute_sectors, lat, lon)
+    except BaseException as exc:
+        fut.set_exception(exc)
+        raise
+    else:
+        fut.set_result(finals)
+        return finals
+    finally:
+        del _INFLIGHT[key]
 
 # ============================================================
 # API
 # ============================================================
 
 @app.get("/exposure")
-def exposure(
+async def exposure(
     lat: float = Query(...),
     lon: float = Query(...),
     height_ft: float = Query(...)
 ):
-    with rasterio.open(NLCD_PATH) as src:
-        transformer = Transformer.from_crs(
-            "EPSG:4326", src.crs, always_xy=True
-        )
-
-        results = []
-        governing = "B"
-
-        for name, start_deg, end_deg in DIRECTIONS:
-            exposures = []
-
-            angles = (
-                [start_deg] if start_deg == end_deg else
-                list(range(start_deg, end_deg, 5))
-            )
-
-            for angle in angles:
-                dx, dy = direction_vector(angle)
-
-                for d in range(0, FETCH_DISTANCE_M, SAMPLE_STEP_M):
-                    lat_s = lat + (dy * d / 111000)
-                    lon_s = lon + (dx * d / (111000 * cos(radians(lat))))
-
-                    try:
-                        nlcd = sample_nlcd(lat_s, lon_s, src, transformer)
-                        exp = NLCD_TO_EXPOSURE.get(nlcd, "C")
-                        exposures.append(exp)
-                    except Exception:
-                        continue
+    # snap to the cache grid: repeat queries from a map pan or retry
+    # land on identical sample points
+    lat_q, lon_q = _snap(lat), _snap(lon)
 
-            # majority rule
-            final_exp = max(set(exposures), key=exposures.count) if exposures else "C"
-            governing = max(governing, final_exp)
+    finals = await _sector_exposures(lat_q, lon_q)
+    governing = max("B", *finals)
 
-            results.append({
-                "direction": name,
-                "exposure": final_exp
-            })
+    results = [
+        {"direction": DIRECTIONS[sector][0], "exposure": finals[sector]}
+        for sector in range(len(DIRECTIONS))
+    ]
 
     return {
         "location": {"lat": lat, "lon": lon, "height_ft": height_ft},
@@ -135,4 +381,4 @@ def exposure(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    uvicorn.run(app, host="127.0.0.1", port=8000, loop="uvloop")